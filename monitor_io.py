@@ -17,10 +17,19 @@
 
 
 import argparse
-import re
+import codecs
+import string
 import sys
-from io import TextIOWrapper
-from typing import Iterable, Iterator, NamedTuple
+from io import FileIO
+from typing import Callable, Iterable, Iterator, NamedTuple
+
+
+_LINE_PREFIX: str = "siodebuguart-"
+_READ_BUFFER_SIZE: int = 1 << 20
+
+# Long POST codes are written one byte at a time, in little-endian byte
+# order, to ports 0x80-0x83. This maps each port to its byte's bit offset.
+_POST_CODE_SHIFTS: dict[int, int] = {0x80: 0, 0x81: 8, 0x82: 16, 0x83: 24}
 
 
 class AddrData(NamedTuple):
@@ -28,24 +37,61 @@ class AddrData(NamedTuple):
     data: int
 
 
+def open_log(path: str) -> FileIO:
+    try:
+        if path == "-":
+            return FileIO(sys.stdin.fileno(), "rb", closefd=False)
+
+        return FileIO(path, "rb")
+    except OSError as e:
+        raise argparse.ArgumentTypeError(f"can't open '{path}': {e}")
+
+def read_lines(logfile: FileIO) -> Iterator[str]:
+    # Sigrok logs can be very large, so read them in big chunks and split
+    # the lines ourselves to cut down on the number of read syscalls. On a
+    # pipe, read() returns whatever is available, so output isn't delayed.
+    decoder: codecs.IncrementalDecoder = codecs.getincrementaldecoder("utf-8")()
+    partial: str = ""
+    while True:
+        chunk: bytes = logfile.read(_READ_BUFFER_SIZE)
+        if not chunk:
+            break
+
+        lines: list[str] = (partial + decoder.decode(chunk)).split("\n")
+        partial = lines.pop()
+        yield from lines
+
+    partial += decoder.decode(b"", final=True)
+    if partial:
+        yield partial
+
 def parse_args() -> argparse.Namespace:
     parser: argparse.ArgumentParser = argparse.ArgumentParser(description="Process and reformat 26-bit hex values from a sigrok log file of a trace of the siodebuguart protocol.")
     parser.add_argument("file",
                         nargs="?",
-                        type=argparse.FileType("r"),
-                        default=sys.stdin,
+                        type=open_log,
+                        default="-",
                         help="Input file (default is stdin).")
 
     return parser.parse_args()
 
 def parse_line(line: str) -> int | None:
-    match: re.Match | None = re.match(r"siodebuguart-\d+: ([0-9A-Fa-f]+)", line)
-    if not match:
+    if not line.startswith(_LINE_PREFIX):
         return None
 
-    hex_str: str = match.group(1).strip()
+    # Lines have the fixed form "siodebuguart-<N>: <HEX>", so there's no
+    # need for a regex to pick them apart.
+    channel, sep, rest = line[len(_LINE_PREFIX):].partition(": ")
+    if not sep or not channel.isdecimal():
+        return None
+
+    # Only accept a bare hex number, since int() would also take signs,
+    # whitespace, underscores and a "0x" prefix.
+    if not rest or rest.lstrip(string.hexdigits):
+        return None
+
+    val: int = int(rest, 16)
 
-    val: int = int(hex_str, 16)
     val &= (1 << 26) - 1  # Ensure 26 bits
 
     return val
@@ -69,30 +115,28 @@ def parse_log(lines: Iterable[str]) -> Iterator[AddrData]:
 def main() -> int:
     args: argparse.Namespace = parse_args()
 
-    logfile: TextIOWrapper = args.file
+    logfile: FileIO = args.file
+
+    # Bind the writer once and emit whole lines, instead of paying for a
+    # print() call (and its argument handling) for every record.
+    write: Callable[[str], int] = sys.stdout.write
 
     long_code: int = 0
     previous_addr_data: AddrData | None = None
-    for addr_data in parse_log(logfile):
-        if addr_data.addr == 0x80:
-            long_code &= 0xFFFFFF00
-            long_code |= addr_data.data
-            if previous_addr_data and previous_addr_data.addr == 0x80:
-                print(f"POST code: 0x{previous_addr_data.data:02X}")
-        elif addr_data.addr == 0x81:
-            long_code &= 0xFFFF00FF
-            long_code |= addr_data.data << 8
-        elif addr_data.addr == 0x82:
-            long_code &= 0xFF00FFFF
-            long_code |= addr_data.data << 16
-        elif addr_data.addr == 0x83:
-            long_code &= 0x00FFFFFF
-            long_code |= addr_data.data << 24
-            print(f"POST code: 0x{long_code:08X}")
+    for addr_data in parse_log(read_lines(logfile)):
+        shift: int | None = _POST_CODE_SHIFTS.get(addr_data.addr)
+        if shift is not None:
+            long_code &= ~(0xFF << shift)
+            long_code |= addr_data.data << shift
+            if shift == 0:
+                if previous_addr_data and previous_addr_data.addr == 0x80:
+                    write(f"POST code: 0x{previous_addr_data.data:02X}\n")
+            elif shift == 24:
+                write(f"POST code: 0x{long_code:08X}\n")
         else:
             if previous_addr_data and previous_addr_data.addr == 0x80:
-                print(f"POST code: 0x{previous_addr_data.data:02X}")
-            print(f"0x{addr_data.addr:04X}: 0x{addr_data.data:02X}")
+                write(f"POST code: 0x{previous_addr_data.data:02X}\n")
+            write(f"0x{addr_data.addr:04X}: 0x{addr_data.data:02X}\n")
 
         previous_addr_data = addr_data
 
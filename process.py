@@ -17,16 +17,59 @@
 
 
 import argparse
-import re
+import codecs
+import string
 import sys
-from io import TextIOWrapper
+from io import FileIO
 from typing import Iterable, Iterator, NamedTuple
 
 
+_LINE_PREFIX: str = "siodebuguart-"
+_READ_BUFFER_SIZE: int = 1 << 20
+
+# Bit-reversed values of all 13-bit integers, for reverse_bits().
+_REV13: list[int] = [int(format(i, "013b")[::-1], 2) for i in range(1 << 13)]
+
+
 class BitRange(NamedTuple):
     start: int
     end: int
 
+class PartSpec(NamedTuple):
+    start: int
+    end: int
+    bits: int
+    mask: int
+    hex_digits: int
+
+
+def open_log(path: str) -> FileIO:
+    try:
+        if path == "-":
+            return FileIO(sys.stdin.fileno(), "rb", closefd=False)
+
+        return FileIO(path, "rb")
+    except OSError as e:
+        raise argparse.ArgumentTypeError(f"can't open '{path}': {e}")
+
+def read_lines(logfile: FileIO) -> Iterator[str]:
+    # Sigrok logs can be very large, so read them in big chunks and split
+    # the lines ourselves to cut down on the number of read syscalls. On a
+    # pipe, read() returns whatever is available, so output isn't delayed.
+    decoder: codecs.IncrementalDecoder = codecs.getincrementaldecoder("utf-8")()
+    partial: str = ""
+    while True:
+        chunk: bytes = logfile.read(_READ_BUFFER_SIZE)
+        if not chunk:
+            break
+
+        lines: list[str] = (partial + decoder.decode(chunk)).split("\n")
+        partial = lines.pop()
+        yield from lines
+
+    partial += decoder.decode(b"", final=True)
+    if partial:
+        yield partial
 
 def parse_args() -> argparse.Namespace:
     parser: argparse.ArgumentParser = argparse.ArgumentParser(description="Process and reformat 26-bit hex values from a sigrok log file of a trace of the siodebuguart protocol.")
@@ -41,27 +84,38 @@ def parse_args() -> argparse.Namespace:
                         help="Bit-reverse the 26-bit value before processing.")
     parser.add_argument("file",
                         nargs="?",
-                        type=argparse.FileType("r"),
-                        default=sys.stdin,
+                        type=open_log,
+                        default="-",
                         help="Input file (default is stdin).")
 
     return parser.parse_args()
 
 def parse_line(line: str) -> int | None:
-    match: re.Match | None = re.match(r"siodebuguart-\d+: ([0-9A-Fa-f]+)", line)
-    if not match:
+    if not line.startswith(_LINE_PREFIX):
         return None
 
-    hex_str: str = match.group(1).strip()
+    # Lines have the fixed form "siodebuguart-<N>: <HEX>", so there's no
+    # need for a regex to pick them apart.
+    channel, sep, rest = line[len(_LINE_PREFIX):].partition(": ")
+    if not sep or not channel.isdecimal():
+        return None
+
+    # Only accept a bare hex number, since int() would also take signs,
+    # whitespace, underscores and a "0x" prefix.
+    if not rest or rest.lstrip(string.hexdigits):
+        return None
+
+    val: int = int(rest, 16)
 
-    val: int = int(hex_str, 16)
     val &= (1 << 26) - 1  # Ensure 26 bits
 
     return val
 
 def reverse_bits(val: int) -> int:
     val &= (1 << 26) - 1  # Ensure 26 bits masked
-    return int(format(val, "026b")[::-1], 2)
+
+    # Reverse each 13-bit half with the lookup table and swap the halves.
+    return (_REV13[val & 0x1FFF] << 13) | _REV13[val >> 13]
 
 def parse_arrange(arrange: str) -> list[BitRange]:
     ranges: list[BitRange] = []
@@ -80,20 +134,30 @@ def parse_arrange(arrange: str) -> list[BitRange]:
 
     return ranges
 
-def format_part(val: int, start: int, end: int, binary: bool) -> str:
-    bits: int = start - end + 1
+def make_part_spec(bit_range: BitRange) -> PartSpec:
+    bits: int = bit_range.start - bit_range.end + 1
     mask: int = (1 << bits) - 1
-    extracted: int = (val >> end) & mask
+    hex_digits: int = (bits + 3) // 4  # ceiling division
+
+    return PartSpec(bit_range.start, bit_range.end, bits, mask, hex_digits)
+
+def format_part(val: int, spec: PartSpec, binary: bool) -> str:
+    extracted: int = (val >> spec.end) & spec.mask
 
     if binary:
-        return f"{extracted:0{bits}b}"
+        return f"{extracted:0{spec.bits}b}"
 
     else:
-        hex_digits: int = (bits + 3) // 4  # ceiling division
-
-        return f"{extracted:0{hex_digits}X}"
+        return f"{extracted:0{spec.hex_digits}X}"
 
 def parse_log(lines: Iterable[str], arrange: str, binary: bool, reverse: bool) -> Iterator[str]:
+    specs: list[PartSpec] = [make_part_spec(bit_range) for bit_range in parse_arrange(arrange)]
+
+    # The default arrangement is the whole value, which can be formatted
+    # directly without extracting any parts.
+    full_width: bool = len(specs) == 1 and (specs[0].start, specs[0].end) == (25, 0)
+    full_width_fmt: str = "{:026b}" if binary else "{:07X}"
+
     for line in lines:
         line = line.strip()
         if not line:
@@ -107,20 +171,18 @@ def parse_log(lines: Iterable[str], arrange: str, binary: bool, reverse: bool) -
         if reverse:
             val = reverse_bits(val)
 
-        ranges: list[BitRange] = parse_arrange(arrange)
-        output_parts: list[str] = []
-        for bit_range in ranges:
-            part_str: str = format_part(val, bit_range.start, bit_range.end, binary)
-            output_parts.append(part_str)
+        if full_width:
+            yield full_width_fmt.format(val)
 
-        yield " ".join(output_parts)
+        else:
+            yield " ".join(format_part(val, spec, binary) for spec in specs)
 
 def main() -> int:
     args: argparse.Namespace = parse_args()
 
-    logfile: TextIOWrapper = args.file
+    logfile: FileIO = args.file
 
-    for line in parse_log(logfile, args.arrange, args.binary, args.reverse):
+    for line in parse_log(read_lines(logfile), args.arrange, args.binary, args.reverse):
         print(line)
 
     return 0
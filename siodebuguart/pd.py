@@ -19,7 +19,6 @@
 ##
 
 import sigrokdecode as srd
-from common.srdhelper import bitpack
 from math import floor, ceil
 
 '''
@@ -34,12 +33,9 @@ This is the list of <ptype>s and their respective <pdata> values:
    - 1st item: the (integer) value of the UART data. Valid values
      range from 0 to 511 (as the data can be up to 9 bits in size).
    - 2nd item: the list of individual data bits and their ss/es numbers.
- - 'PARITYBIT': The data is the (integer) value of the parity bit (0/1).
  - 'STOPBIT': The data is the (integer) value of the stop bit (0 or 1).
  - 'INVALID STARTBIT': The data is the (integer) value of the start bit (0/1).
  - 'INVALID STOPBIT': The data is the (integer) value of the stop bit (0/1).
- - 'PARITY ERROR': The data is a tuple with two entries. The first one is
-   the expected parity value, the second is the actual parity value.
  - 'BREAK': The data is always 0.
  - 'FRAME': The data is always a tuple containing two items: The (integer)
    value of the UART data, and a boolean which reflects the validity of the
@@ -53,29 +49,8 @@ The <rxtx> field is 0 for RX packets, 1 for TX packets.
 RX = 0
 TX = 1
 
-# Given a parity type to check (odd, even, zero, one), the value of the
-# parity bit, the value of the data, and the length of the data (5-9 bits,
-# usually 8 bits) return True if the parity is correct, False otherwise.
-# 'none' is _not_ allowed as value for 'parity_type'.
-def parity_ok(parity_type, parity_bit, data, data_bits):
-
-    if parity_type == 'ignore':
-        return True
-
-    # Handle easy cases first (parity bit is always 1 or 0).
-    if parity_type == 'zero':
-        return parity_bit == 0
-    elif parity_type == 'one':
-        return parity_bit == 1
-
-    # Count number of 1 (high) bits in the data (and the parity bit itself!).
-    ones = bin(data).count('1') + parity_bit
-
-    # Check for odd/even parity.
-    if parity_type == 'odd':
-        return (ones % 2) == 1
-    elif parity_type == 'even':
-        return (ones % 2) == 0
+# Receiver states, kept as integers so that per-bit state dispatch is cheap.
+WAIT_FOR_START_BIT, GET_START_BIT, GET_DATA_BITS, GET_STOP_BITS = range(4)
 
 class SamplerateError(Exception):
     pass
@@ -151,27 +126,27 @@ class Decoder(srd.Decoder):
         ('tx', 'TX dump'),
         ('rxtx', 'RX/TX dump'),
     )
-    idle_state = ['WAIT FOR START BIT', 'WAIT FOR START BIT']
+    idle_state = [WAIT_FOR_START_BIT, WAIT_FOR_START_BIT]
 
     def putx(self, rxtx, data):
-        s, halfbit = self.startsample[rxtx], self.bit_width / 2.0
-        self.put(s - floor(halfbit), self.samplenum + ceil(halfbit), self.out_ann, data)
+        s = self.startsample[rxtx]
+        self.put(s - self.halfbit_floor, self.samplenum + self.halfbit_ceil, self.out_ann, data)
 
     def putx_packet(self, rxtx, data):
-        s, halfbit = self.ss_packet[rxtx], self.bit_width / 2.0
-        self.put(s - floor(halfbit), self.samplenum + ceil(halfbit), self.out_ann, data)
+        s = self.ss_packet[rxtx]
+        self.put(s - self.halfbit_floor, self.samplenum + self.halfbit_ceil, self.out_ann, data)
 
     def putpx(self, rxtx, data):
-        s, halfbit = self.startsample[rxtx], self.bit_width / 2.0
-        self.put(s - floor(halfbit), self.samplenum + ceil(halfbit), self.out_python, data)
+        s = self.startsample[rxtx]
+        self.put(s - self.halfbit_floor, self.samplenum + self.halfbit_ceil, self.out_python, data)
 
     def putg(self, data):
-        s, halfbit = self.samplenum, self.bit_width / 2.0
-        self.put(s - floor(halfbit), s + ceil(halfbit), self.out_ann, data)
+        s = self.samplenum
+        self.put(s - self.halfbit_floor, s + self.halfbit_ceil, self.out_ann, data)
 
     def putp(self, data):
-        s, halfbit = self.samplenum, self.bit_width / 2.0
-        self.put(s - floor(halfbit), s + ceil(halfbit), self.out_python, data)
+        s = self.samplenum
+        self.put(s - self.halfbit_floor, s + self.halfbit_ceil, self.out_python, data)
 
     def putgse(self, ss, es, data):
         self.put(ss, es, self.out_ann, data)
@@ -179,9 +154,12 @@ class Decoder(srd.Decoder):
     def putpse(self, ss, es, data):
         self.put(ss, es, self.out_python, data)
 
-    def putbin(self, rxtx, data):
-        s, halfbit = self.startsample[rxtx], self.bit_width / 2.0
-        self.put(s - floor(halfbit), self.samplenum + ceil(halfbit), self.out_binary, data)
+    def putbin(self, rxtx, bdata):
+        # Emit the same bytes to both the per-direction and RX/TX dumps.
+        ss = self.startsample[rxtx] - self.halfbit_floor
+        es = self.samplenum + self.halfbit_ceil
+        self.put(ss, es, self.out_binary, [rxtx, bdata])
+        self.put(ss, es, self.out_binary, [2, bdata])
 
     def __init__(self):
         self.reset()
@@ -193,10 +171,9 @@ class Decoder(srd.Decoder):
         self.startbit = [-1, -1]
         self.cur_data_bit = [0, 0]
         self.datavalue = [0, 0]
-        self.paritybit = [-1, -1]
         self.stopbit1 = [-1, -1]
         self.startsample = [-1, -1]
-        self.state = ['WAIT FOR START BIT', 'WAIT FOR START BIT']
+        self.state = [WAIT_FOR_START_BIT, WAIT_FOR_START_BIT]
         self.databits = [[], []]
         self.break_start = [None, None]
         self.packet_cache = [[], []]
@@ -208,30 +185,31 @@ class Decoder(srd.Decoder):
         self.out_binary = self.register(srd.OUTPUT_BINARY)
         self.out_ann = self.register(srd.OUTPUT_ANN)
         self.bw = (26 + 7) // 8
+        self.value_fmt = '{{:0{:d}X}}'.format((26 + 4 - 1) // 4)
 
     def metadata(self, key, value):
         if key == srd.SRD_CONF_SAMPLERATE:
             self.samplerate = value
             # The width of one UART bit in number of samples.
             self.bit_width = float(self.samplerate) / float(self.options['baudrate'])
-
-    def get_sample_point(self, rxtx, bitnum):
-        # Determine absolute sample number of a bit slot's sample point.
-        # bitpos is the samplenumber which is in the middle of the
-        # specified UART bit (0 = start bit, 1..x = data, x+1 = parity bit
-        # (if used) or the first stop bit, and so on).
-        # The samples within bit are 0, 1, ..., (bit_width - 1), therefore
-        # index of the middle sample within bit window is (bit_width - 1) / 2.
-        bitpos = self.frame_start[rxtx] + (self.bit_width - 1) / 2.0
-        bitpos += bitnum * self.bit_width
-        return bitpos
+            # Half-bit offsets used to position annotations around a sample.
+            self.halfbit_floor = floor(self.bit_width / 2.0)
+            self.halfbit_ceil = ceil(self.bit_width / 2.0)
+            self.halfbit_int = int(self.bit_width / 2)
+            # Offsets from the start of a frame to each bit slot's sample
+            # point, which is the sample in the middle of the specified UART
+            # bit (0 = start bit, 1..x = data, x+1 = the first stop bit).
+            # The samples within bit are 0, 1, ..., (bit_width - 1), therefore
+            # index of the middle sample within bit window is (bit_width - 1) / 2.
+            self.bit_offsets = [(self.bit_width - 1) / 2.0 + bitnum * self.bit_width
+                for bitnum in range(1 + 26 + 1)]
 
     def wait_for_start_bit(self, rxtx, signal):
         # Save the sample number where the start bit begins.
         self.frame_start[rxtx] = self.samplenum
         self.frame_valid[rxtx] = True
 
-        self.state[rxtx] = 'GET START BIT'
+        self.state[rxtx] = GET_START_BIT
 
     def get_start_bit(self, rxtx, signal):
         self.startbit[rxtx] = signal
@@ -242,10 +220,10 @@ class Decoder(srd.Decoder):
             self.putp(['INVALID STARTBIT', rxtx, self.startbit[rxtx]])
             self.putg([rxtx + 10, ['Frame error', 'Frame err', 'FE']])
             self.frame_valid[rxtx] = False
-            es = self.samplenum + ceil(self.bit_width / 2.0)
+            es = self.samplenum + self.halfbit_ceil
             self.putpse(self.frame_start[rxtx], es, ['FRAME', rxtx,
                 (self.datavalue[rxtx], self.frame_valid[rxtx])])
-            self.state[rxtx] = 'WAIT FOR START BIT'
+            self.state[rxtx] = WAIT_FOR_START_BIT
             return
 
         self.cur_data_bit[rxtx] = 0
@@ -255,12 +233,11 @@ class Decoder(srd.Decoder):
         self.putp(['STARTBIT', rxtx, self.startbit[rxtx]])
         self.putg([rxtx + 2, ['Start bit', 'Start', 'S']])
 
-        self.state[rxtx] = 'GET DATA BITS'
+        self.state[rxtx] = GET_DATA_BITS
 
     def handle_packet(self, rxtx):
-        d = 'rx' if (rxtx == RX) else 'tx'
-        delim = self.options[d + '_packet_delim']
-        plen = self.options[d + '_packet_len']
+        delim = self.packet_delim[rxtx]
+        plen = self.packet_len[rxtx]
         if delim == -1 and plen == -1:
             return
 
@@ -271,37 +248,35 @@ class Decoder(srd.Decoder):
         self.packet_cache[rxtx].append(self.datavalue[rxtx])
         if self.datavalue[rxtx] == delim or len(self.packet_cache[rxtx]) == plen:
             self.es_packet[rxtx] = self.samplenum
-            s = ''
-            for b in self.packet_cache[rxtx]:
-                s += self.format_value(b)
-                if 'hex' != 'ascii':
-                    s += ' '
-            if 'hex' != 'ascii' and s[-1] == ' ':
-                s = s[:-1] # Drop trailing space.
+            s = ' '.join(map(self.format_value, self.packet_cache[rxtx]))
             self.putx_packet(rxtx, [16 + rxtx, [s]])
-            self.packet_cache[rxtx] = []
+            self.packet_cache[rxtx].clear()
 
     def get_data_bits(self, rxtx, signal):
+        s, halfbit = self.samplenum, self.halfbit_int
+
         # Save the sample number of the middle of the first data bit.
         if self.startsample[rxtx] == -1:
-            self.startsample[rxtx] = self.samplenum
+            self.startsample[rxtx] = s
 
         self.putg([rxtx + 12, ['%d' % signal]])
 
         # Store individual data bits and their start/end samplenumbers.
-        s, halfbit = self.samplenum, int(self.bit_width / 2)
         self.databits[rxtx].append([signal, s - halfbit, s + halfbit])
 
+        # Accumulate the data value as the bits arrive.
+        datavalue, bitnum = self.datavalue, self.cur_data_bit[rxtx]
+        if self.msb_first:
+            datavalue[rxtx] = (datavalue[rxtx] << 1) | signal
+        else:
+            datavalue[rxtx] |= signal << bitnum
+
         # Return here, unless we already received all data bits.
-        self.cur_data_bit[rxtx] += 1
-        if self.cur_data_bit[rxtx] < 26:
+        bitnum += 1
+        self.cur_data_bit[rxtx] = bitnum
+        if bitnum < 26:
             return
 
-        # Convert accumulated data bits to a data value.
-        bits = [b[0] for b in self.databits[rxtx]]
-        if self.options['bit_order'] == 'msb-first':
-            bits.reverse()
-        self.datavalue[rxtx] = bitpack(bits)
         self.putpx(rxtx, ['DATA', rxtx,
             (self.datavalue[rxtx], self.databits[rxtx])])
 
@@ -311,39 +286,17 @@ class Decoder(srd.Decoder):
             self.putx(rxtx, [rxtx, [formatted]])
 
         bdata = b.to_bytes(self.bw, byteorder='big')
-        self.putbin(rxtx, [rxtx, bdata])
-        self.putbin(rxtx, [2, bdata])
+        self.putbin(rxtx, bdata)
 
         self.handle_packet(rxtx)
 
         self.databits[rxtx] = []
 
-        # Advance to either reception of the parity bit, or reception of
-        # the STOP bits if parity is not applicable.
-        self.state[rxtx] = 'GET PARITY BIT'
-        if 'none' == 'none':
-            self.state[rxtx] = 'GET STOP BITS'
+        # There is no parity bit, so advance to reception of the STOP bits.
+        self.state[rxtx] = GET_STOP_BITS
 
     def format_value(self, v):
-        digits = (26 + 4 - 1) // 4
-        fmtchar = "X"
-        fmt = "{{:0{:d}{:s}}}".format(digits, fmtchar)
-        return fmt.format(v)
-
-    def get_parity_bit(self, rxtx, signal):
-        self.paritybit[rxtx] = signal
-
-        if parity_ok('none', self.paritybit[rxtx],
-                     self.datavalue[rxtx], 26):
-            self.putp(['PARITYBIT', rxtx, self.paritybit[rxtx]])
-            self.putg([rxtx + 4, ['Parity bit', 'Parity', 'P']])
-        else:
-            # TODO: Return expected/actual parity values.
-            self.putp(['PARITY ERROR', rxtx, (0, 1)]) # FIXME: Dummy tuple...
-            self.putg([rxtx + 6, ['Parity error', 'Parity err', 'PE']])
-            self.frame_valid[rxtx] = False
-
-        self.state[rxtx] = 'GET STOP BITS'
+        return self.value_fmt.format(v)
 
     # TODO: Currently only supports 1 stop bit.
     def get_stop_bits(self, rxtx, signal):
@@ -359,11 +312,11 @@ class Decoder(srd.Decoder):
         self.putg([rxtx + 4, ['Stop bit', 'Stop', 'T']])
 
         # Pass the complete UART frame to upper layers.
-        es = self.samplenum + ceil(self.bit_width / 2.0)
+        es = self.samplenum + self.halfbit_ceil
         self.putpse(self.frame_start[rxtx], es, ['FRAME', rxtx,
             (self.datavalue[rxtx], self.frame_valid[rxtx])])
 
-        self.state[rxtx] = 'WAIT FOR START BIT'
+        self.state[rxtx] = WAIT_FOR_START_BIT
         self.idle_start[rxtx] = self.frame_start[rxtx] + self.frame_len_sample_count
 
     def handle_break(self, rxtx):
@@ -371,25 +324,22 @@ class Decoder(srd.Decoder):
                 ['BREAK', rxtx, 0])
         self.putgse(self.frame_start[rxtx], self.samplenum,
                 [rxtx + 14, ['Break condition', 'Break', 'Brk', 'B']])
-        self.state[rxtx] = 'WAIT FOR START BIT'
+        self.state[rxtx] = WAIT_FOR_START_BIT
 
     def get_wait_cond(self, rxtx, inv):
         # Return condititions that are suitable for Decoder.wait(). Those
         # conditions either match the falling edge of the START bit, or
         # the sample point of the next bit time.
         state = self.state[rxtx]
-        if state == 'WAIT FOR START BIT':
+        if state == WAIT_FOR_START_BIT:
             return {rxtx: 'r' if inv else 'f'}
-        if state == 'GET START BIT':
+        if state == GET_START_BIT:
             bitnum = 0
-        elif state == 'GET DATA BITS':
+        elif state == GET_DATA_BITS:
             bitnum = 1 + self.cur_data_bit[rxtx]
-        elif state == 'GET PARITY BIT':
+        elif state == GET_STOP_BITS:
             bitnum = 1 + 26
-        elif state == 'GET STOP BITS':
-            bitnum = 1 + 26
-            bitnum += 0 if 'none' == 'none' else 1
-        want_num = ceil(self.get_sample_point(rxtx, bitnum))
+        want_num = ceil(self.frame_start[rxtx] + self.bit_offsets[bitnum])
         return {'skip': want_num - self.samplenum}
 
     def get_idle_cond(self, rxtx, inv):
@@ -409,15 +359,13 @@ class Decoder(srd.Decoder):
             signal = not signal
 
         state = self.state[rxtx]
-        if state == 'WAIT FOR START BIT':
+        if state == WAIT_FOR_START_BIT:
             self.wait_for_start_bit(rxtx, signal)
-        elif state == 'GET START BIT':
+        elif state == GET_START_BIT:
             self.get_start_bit(rxtx, signal)
-        elif state == 'GET DATA BITS':
+        elif state == GET_DATA_BITS:
             self.get_data_bits(rxtx, signal)
-        elif state == 'GET PARITY BIT':
-            self.get_parity_bit(rxtx, signal)
-        elif state == 'GET STOP BITS':
+        elif state == GET_STOP_BITS:
             self.get_stop_bits(rxtx, signal)
 
     def inspect_edge(self, rxtx, signal, inv):
@@ -465,54 +413,72 @@ class Decoder(srd.Decoder):
 
         opt = self.options
         inv = [opt['invert_rx'] == 'yes', opt['invert_tx'] == 'yes']
+
+        # Look up the options used for every frame just once.
+        self.msb_first = opt['bit_order'] == 'msb-first'
+        self.packet_delim = [opt['rx_packet_delim'], opt['tx_packet_delim']]
+        self.packet_len = [opt['rx_packet_len'], opt['tx_packet_len']]
         cond_data_idx = [None] * len(has_pin)
 
         # Determine the number of samples for a complete frame's time span.
         # A period of low signal (at least) that long is a break condition.
         frame_samples = 1 # START
         frame_samples += 26
-        frame_samples += 0 if 'none' == 'none' else 1
         frame_samples += 1
         frame_samples *= self.bit_width
         self.frame_len_sample_count = ceil(frame_samples)
         self.break_min_sample_count = self.frame_len_sample_count
         cond_edge_idx = [None] * len(has_pin)
-        cond_idle_idx = [None] * len(has_pin)
+
+        # Build the condition list once. The data and edge conditions of
+        # each pin have fixed slots, and only the data conditions need to
+        # be updated on each iteration. Idle conditions come and go, so
+        # they are appended after the fixed slots.
+        conds = []
+        for ch in (RX, TX):
+            if has_pin[ch]:
+                cond_data_idx[ch] = len(conds)
+                conds.append(None)
+                cond_edge_idx[ch] = len(conds)
+                conds.append({ch: 'e'})
+        fixed_conds_len = len(conds)
+
+        # Bind loop invariants to locals, this loop runs for every bit.
+        has_rx, has_tx = has_pin
+        inv_rx, inv_tx = inv
+        data_idx_rx, data_idx_tx = cond_data_idx
+        edge_idx_rx, edge_idx_tx = cond_edge_idx
+        idle_idx_rx = idle_idx_tx = None
 
         while True:
-            conds = []
-            if has_pin[RX]:
-                cond_data_idx[RX] = len(conds)
-                conds.append(self.get_wait_cond(RX, inv[RX]))
-                cond_edge_idx[RX] = len(conds)
-                conds.append({RX: 'e'})
-                cond_idle_idx[RX] = None
-                idle_cond = self.get_idle_cond(RX, inv[RX])
+            del conds[fixed_conds_len:]
+            if has_rx:
+                conds[data_idx_rx] = self.get_wait_cond(RX, inv_rx)
+                idle_idx_rx = None
+                idle_cond = self.get_idle_cond(RX, inv_rx)
                 if idle_cond:
-                    cond_idle_idx[RX] = len(conds)
+                    idle_idx_rx = len(conds)
                     conds.append(idle_cond)
-            if has_pin[TX]:
-                cond_data_idx[TX] = len(conds)
-                conds.append(self.get_wait_cond(TX, inv[TX]))
-                cond_edge_idx[TX] = len(conds)
-                conds.append({TX: 'e'})
-                cond_idle_idx[TX] = None
-                idle_cond = self.get_idle_cond(TX, inv[TX])
+            if has_tx:
+                conds[data_idx_tx] = self.get_wait_cond(TX, inv_tx)
+                idle_idx_tx = None
+                idle_cond = self.get_idle_cond(TX, inv_tx)
                 if idle_cond:
-                    cond_idle_idx[TX] = len(conds)
+                    idle_idx_tx = len(conds)
                     conds.append(idle_cond)
             (rx, tx) = self.wait(conds)
-            if cond_data_idx[RX] is not None and self.matched[cond_data_idx[RX]]:
-                self.inspect_sample(RX, rx, inv[RX])
-            if cond_edge_idx[RX] is not None and self.matched[cond_edge_idx[RX]]:
-                self.inspect_edge(RX, rx, inv[RX])
-                self.inspect_idle(RX, rx, inv[RX])
-            if cond_idle_idx[RX] is not None and self.matched[cond_idle_idx[RX]]:
-                self.inspect_idle(RX, rx, inv[RX])
-            if cond_data_idx[TX] is not None and self.matched[cond_data_idx[TX]]:
-                self.inspect_sample(TX, tx, inv[TX])
-            if cond_edge_idx[TX] is not None and self.matched[cond_edge_idx[TX]]:
-                self.inspect_edge(TX, tx, inv[TX])
-                self.inspect_idle(TX, tx, inv[TX])
-            if cond_idle_idx[TX] is not None and self.matched[cond_idle_idx[TX]]:
-                self.inspect_idle(TX, tx, inv[TX])
+            matched = self.matched
+            if data_idx_rx is not None and matched[data_idx_rx]:
+                self.inspect_sample(RX, rx, inv_rx)
+            if edge_idx_rx is not None and matched[edge_idx_rx]:
+                self.inspect_edge(RX, rx, inv_rx)
+                self.inspect_idle(RX, rx, inv_rx)
+            if idle_idx_rx is not None and matched[idle_idx_rx]:
+                self.inspect_idle(RX, rx, inv_rx)
+            if data_idx_tx is not None and matched[data_idx_tx]:
+                self.inspect_sample(TX, tx, inv_tx)
+            if edge_idx_tx is not None and matched[edge_idx_tx]:
+                self.inspect_edge(TX, tx, inv_tx)
+                self.inspect_idle(TX, tx, inv_tx)
+            if idle_idx_tx is not None and matched[idle_idx_tx]:
+                self.inspect_idle(TX, tx, inv_tx)